@@ -7,8 +7,18 @@ operations: sum, difference, product and division, with the minimum amount of pr
 write the output (expression and number of primes used) for every test case in OUT_FILENAME file.
 """
 
+import json
+import os
+import sqlite3
+from array import array
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right
 from datetime import datetime
+from functools import partial
 from heapq import heappush, heappop
+from itertools import islice
+from mmap import mmap, ACCESS_READ
+from multiprocessing import Pool, cpu_count
 from time import time
 
 __author__ = "Pablo Sanz Sanz"
@@ -19,12 +29,67 @@ START_MOMENT = datetime.now()
 """ Maximum number of secs available for the algorithm to finish """
 MAX_TIME = 240
 
+""" Number of secs at the end of MAX_TIME reserved to write the remaining results """
+SAFETY_TIME = 15
+
+""" Maximum number of secs spent searching a single test case (None for no limit apart from MAX_TIME) """
+MAX_CASE_TIME = None
+
 """ Name of the input file """
 IN_FILENAME = "TEST.txt"
 
 """ Name of the output file """
 OUT_FILENAME = "SCORE.txt"
 
+""" Number of worker processes used to solve the test cases (None to use one per available core) """
+NUM_WORKERS = None
+
+""" Maximum number of test cases with the same prime solved together by a worker process """
+CHUNK_SIZE = 16
+
+""" Maximum number of chunks of test cases waiting in or for the worker processes at once """
+BATCH_SIZE = 1000
+
+""" Name of the file with the precomputed cost table """
+TABLE_FILENAME = "COSTS.bin"
+
+""" Default number of targets (from 0) whose minimal cost is precomputed in the cost table """
+TABLE_CEILING = 10 ** 6
+
+""" Maximum number of primes of the numbers above the table ceiling that are found bottom-up for every prime, so the
+    search can meet them halfway (0 to disable it) """
+MEET_COST = 4
+
+""" Maximum number of numbers in the meet layer of every prime: the greatest counts are left out until it fits """
+MEET_SIZE = 10 ** 5
+
+""" Whether find_expression uses the iterative deepening search, whose memory only grows with the depth of the search,
+    instead of the best-first one """
+ITERATIVE_DEEPENING = False
+
+""" Maximum number of quotients remembered by the iterative deepening search to discard repeated ones """
+TRANSPOSITION_SIZE = 10 ** 5
+
+""" Maximum number of nodes kept on every level by the beam search, which trades the optimality of the results for a
+    predictable time (None to use an exact search) """
+BEAM_WIDTH = None
+
+""" Maximum number of solved test cases kept in memory by every process (0 to disable the cache) """
+CACHE_SIZE = 100000
+
+""" Name of the sqlite database where solved test cases are persisted between executions (None to disable it) """
+CACHE_FILENAME = None
+
+""" Maximum number of solved quotients kept by every process for every prime to be shared between test cases """
+SUBPROBLEM_SIZE = 10 ** 4
+
+""" Name of the JSON file with the probe policy tuned by probe_tuner.py (the default policy is used if it doesn't
+    exist) """
+PROBE_FILENAME = "PROBES.json"
+
+""" Name of the JSON file where the search statistics of the whole batch are written (None to not collect them) """
+STATS_FILENAME = None
+
 """ First field of every solution in the output file (using id card number as I'm not in a team) """
 TEAM_NAME = "50361137S"
 
@@ -40,97 +105,343 @@ MIN_NON_DECOMPOSABLE = 269
 """ Set with all numbers between 1 (included) and MIN_NON_DECOMPOSABLE (excluded) """
 NUMBERS = {x for x in range(1, MIN_NON_DECOMPOSABLE)}
 
-""" Dictionary that maps a number with its factorization with two primes """
-CROSS_PRODUCTS = {p * q: (p, q) for p in PRIMES for q in PRIMES if p > 1 and q > 1 and p * q < MIN_NON_DECOMPOSABLE}
+""" Number of powers of the maximum prime considered when bounding the size of a quotient (far beyond any target) """
+MAX_POWER = 64
+
+""" Number of the greatest valid primes from which the greedy solutions that start the search begin to divide """
+PORTFOLIO_SIZE = 4
 
-""" Constant r = NUM/DEN used to check when to call find_some_solution function """
+""" Constant r = NUM/DEN used to check when to call find_random_solution function by default (see ProbePolicy) """
 NUM, DEN = 3, 1
 
 
-def get_unreachable_numbers():
+def get_cross_products(limit = MIN_NON_DECOMPOSABLE):
     """
-    Returns a dictionary matching every prime number with the set of numbers that couldn't be reached with two prime
-    numbers if we removed that prime number.
-    :return: a dictionary {p: {n_1, ..., n_p}} in which p is a prime number and {n_1, ..., n_p} is the set of numbers
-    between 1 and 97 that couldn't be reached with two or less prime numbers if we removed p
+    Returns a list matching every number with its factorization with two primes.
+    :param limit: length of the list (MIN_NON_DECOMPOSABLE by default)
+    :return: a list in which the element at index n is a pair (p, q) such that p * q = n with p, q > 1, or (0, 0) if
+    there's no such pair
     """
+    result = [(0, 0)] * limit
+    for p in PRIMES:
+        for q in PRIMES:
+            if p > 1 and q > 1 and p * q < limit:
+                result[p * q] = (p, q)
+    return result
+
+
+""" List that maps a number with its factorization with two primes """
+CROSS_PRODUCTS = get_cross_products()
+
+
+def get_unreachable_numbers(limit = MIN_NON_DECOMPOSABLE):
+    """
+    Returns a dictionary matching every prime number with a mask of the numbers that couldn't be reached with two prime
+    numbers if we removed that prime number. All sums, differences and products of two primes are computed only once
+    and then every prime just discards the ones that use it.
+    :param limit: length of every mask (MIN_NON_DECOMPOSABLE by default)
+    :return: a dictionary {p: mask} in which p is a prime number and mask is a bytearray such that mask[n] is 1 if n is
+    between 1 and limit - 1 and couldn't be reached with two or less prime numbers if we removed p, and 0 otherwise
+    """
+    # Triplets (n, x, y) where n is reachable using only the primes x and y
+    reachable = [(x, x, x) for x in PRIMES if x < limit]
+    reachable += [(n, x, y) for x in PRIMES for y in PRIMES for n in (x + y, x - y, x * y) if 0 < n < limit]
     result = {}
     for p in PRIMES:
-        primes = [q for q in PRIMES if q != p]
-        sums_set = {x + y for x in primes for y in primes}
-        diff_set = {x - y for x in primes for y in primes}
-        prod_set = {x * y for x in primes for y in primes}
-        all_sets = sums_set.union(diff_set).union(prod_set).union(primes)
-        result[p] = NUMBERS.difference(all_sets)
+        mask = bytearray([0]) + bytearray([1]) * (limit - 1)
+        for n, x, y in reachable:
+            if x != p and y != p:
+                mask[n] = 0
+        result[p] = mask
     return result
 
 
-""" Dictionary that maps every prime number with a subset of NUMBERS that can't be decomposed with only two primes if we
-    don't use that prime number """
+""" Dictionary that maps every prime number with a mask of the numbers in NUMBERS that can't be decomposed with only
+    two primes if we don't use that prime number """
 UNREACHABLE = get_unreachable_numbers()
 
 
-class Node:
+def get_remainder_costs():
+    """
+    Returns a dictionary matching every prime number with the number of primes needed to decompose every remainder if
+    we removed that prime number, so the cost of a remainder is a single lookup.
+    :return: a dictionary {p: costs} in which p is a prime number and costs is a bytearray of length
+    MIN_NON_DECOMPOSABLE such that costs[n] is 0 if n is 0 (no remainder), 1 if n is a prime other than p, 2 if n can be
+    reached with two primes and 3 otherwise
+    """
+    result = {}
+    for p, unreachable in UNREACHABLE.items():
+        result[p] = bytearray([0]) + bytearray(1 if n in PRIMES and n != p else 2 if not unreachable[n] else 3
+                                               for n in range(1, MIN_NON_DECOMPOSABLE))
+    return result
+
+
+""" Dictionary that maps every prime number with the number of primes needed to decompose every number in NUMBERS (and
+    0) as a remainder if we don't use that prime number """
+REMAINDER_COSTS = get_remainder_costs()
+
+
+def read_cost_table(filename):
+    """
+    Maps the cost table written by write_cost_table into memory. The file is not read: every process using the table
+    shares the same pages of the OS cache.
+    :param filename: name of the file with the table
+    :return: a dictionary {p: costs} in which costs is an indexable object such that costs[n] is the minimal number of
+    primes needed to decompose n if we removed p, or None if the file doesn't exist or is empty
+    """
+    try:
+        with open(filename, 'rb') as file:
+            # The map stays valid after closing the file
+            data = memoryview(mmap(file.fileno(), 0, access = ACCESS_READ))
+            file.close()
+    except (FileNotFoundError, ValueError):
+        return None
+    size = len(data) // len(PRIMES)
+    return {p: data[i * size:(i + 1) * size] for i, p in enumerate(PRIMES)}
+
+
+""" Dictionary that maps every prime number with the precomputed costs of all numbers below the table ceiling if we
+    don't use that prime number (None if there is no table) """
+COST_TABLE = read_cost_table(TABLE_FILENAME)
+
+
+class ResultCache:
     """
-    Node for the branch and bound algorithm. It contains the expression, parentheses' depth, prime count and lower
-    bound at a point of the search tree. The expression is a reversed list of strings where every element is either a
-    prime number or an operator (or parentheses).
+    Cache of solved test cases keyed by target and unused prime. It keeps the most recently used results in memory and
+    evicts the least recently used one when it's full. Results can also be persisted in a sqlite database so they
+    survive between executions.
     """
 
-    def __init__(self, expression, depth, count, min_result):
+    def __init__(self, size, filename = None):
         """
-        Constructs a node.
-        :param expression: a list containing a valid partial expression
-        :param depth: current parentheses' depth in the expression
-        :param count: number of primes in the expression
-        :param min_result: lower bound of the result
+        Constructs a cache.
+        :param size: maximum number of results kept in memory
+        :param filename: name of the sqlite database where results are persisted (None to keep them only in memory)
         """
-        self._expression = expression
-        self._depth = depth
-        self._count = count
-        self._min = min_result
+        self._size = size
+        self._filename = filename
+        self._results = OrderedDict()
+        self._connection = None
+        self._pid = None
 
-    def expression(self):
+    def get(self, n, prime):
         """
-        Expression getter.
-        :return: a list containing the valid partial expression of this node
+        Returns the cached result for the given test case.
+        :param n: target number
+        :param prime: unused prime
+        :return: a pair (expression, count) as returned by find_expression or None if it's not cached
         """
-        return self._expression
+        key = (n, prime)
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+        if self._filename is None:
+            return None
+        row = self.connection().execute("SELECT expression, count FROM results WHERE target = ? AND prime = ?",
+                                        (str(n), prime)).fetchone()
+        if row is None:
+            return None
+        self._store(key, row)
+        return row
 
-    def depth(self):
+    def put(self, n, prime, expression, count):
         """
-        Depth getter.
-        :return: parentheses' depth in the expression of this node
+        Saves the result of the given test case.
+        :param n: target number
+        :param prime: unused prime
+        :param expression: string expression that evaluates to n
+        :param count: number of primes used in the expression
+        :return: nothing
         """
-        return self._depth
+        self._store((n, prime), (expression, count))
+        if self._filename is not None:
+            connection = self.connection()
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)", (str(n), prime, expression, count))
+            connection.commit()
 
-    def count(self):
+    def connection(self):
         """
-        Count getter.
-        :return: number of primes in the expression of this node
+        Connection getter. The connection is opened by every process the first time it's needed, as it can't be
+        shared with the worker processes.
+        :return: a connection to the sqlite database
         """
-        return self._count
+        if self._connection is None or self._pid != os.getpid():
+            # Other processes may be writing at the same time
+            self._connection = sqlite3.connect(self._filename, timeout = 60)
+            self._connection.execute("PRAGMA journal_mode = WAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS results (target TEXT, prime INTEGER, expression TEXT, "
+                                     "count INTEGER, PRIMARY KEY (target, prime))")
+            self._pid = os.getpid()
+        return self._connection
 
-    def __lt__(self, other):
-        return self._min < other._min or self._min == other._min and self._expression[-1] < other._expression[-1]
+    def _store(self, key, result):
+        """
+        Saves the result in memory evicting the least recently used one if the cache is full.
+        :param key: pair (target, prime)
+        :param result: pair (expression, count)
+        :return: nothing
+        """
+        if self._size <= 0:
+            return
+        self._results[key] = result
+        self._results.move_to_end(key)
+        if len(self._results) > self._size:
+            self._results.popitem(last = False)
+
+
+""" Cache with the results of the test cases solved by this process """
+RESULT_CACHE = ResultCache(CACHE_SIZE, CACHE_FILENAME)
+
+
+class SearchStats:
+    """
+    Statistics of one or more executions of find_expression that needed a search (not solved by the tables nor by
+    previous searches): nodes pushed to and popped from the queue, branches pruned by every reason, calls to
+    find_random_solution, time needed to find the first and the final solutions and primes between the results of the
+    beam search and their admissible lower bounds.
+    """
+
+    __slots__ = ("searches", "pushed", "popped", "count_prunes", "seen_prunes", "bound_prunes", "probes",
+                 "first_solution_time", "solution_time", "max_solution_time", "beam_gap", "max_beam_gap")
+
+    def __init__(self):
+        """
+        Constructs empty statistics.
+        """
+        for field in self.__slots__:
+            setattr(self, field, 0)
+
+    def add(self, other):
+        """
+        Adds the statistics of other searches to these ones.
+        :param other: statistics to be added
+        :return: nothing
+        """
+        for field in self.__slots__:
+            if field.startswith("max_"):
+                setattr(self, field, max(getattr(self, field), getattr(other, field)))
+            else:
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def to_dict(self):
+        """
+        Returns the statistics as a dictionary that can be dumped as JSON, with the averages of the times.
+        :return: a dictionary that maps every statistic with its value
+        """
+        result = {field: getattr(self, field) for field in self.__slots__}
+        searches = max(self.searches, 1)
+        result["avg_first_solution_time"] = self.first_solution_time / searches
+        result["avg_solution_time"] = self.solution_time / searches
+        result["avg_beam_gap"] = self.beam_gap / searches
+        return result
+
+
+class ProbePolicy:
+    """
+    Policy that decides when the search probes a greedy solution from a new node: when the count of the best solution
+    found is at least r times the lower bound of the node, and only until a budget of probes is spent. Both r = num/den
+    and the budget depend on the magnitude of the target number.
+    """
+
+    def __init__(self, settings = None):
+        """
+        Constructs a policy.
+        :param settings: dictionary that maps a magnitude m with a triplet (num, den, budget) used for targets of
+        magnitude m or greater, up to the next magnitude in the dictionary, where budget is the maximum number of probes
+        of every search (None for no limit). Targets below every magnitude use NUM/DEN with no limit
+        """
+        self.settings = dict(sorted(settings.items())) if settings else {}
+        self._magnitudes = list(self.settings)
+
+    def trigger(self, n):
+        """
+        Returns the trigger of the probes of a search.
+        :param n: target number of the search
+        :return: a ProbeTrigger with the settings of the magnitude of n
+        """
+        i = bisect_right(self._magnitudes, len(str(n)) - 1) - 1
+        num, den, budget = self.settings[self._magnitudes[i]] if i >= 0 else (NUM, DEN, None)
+        return ProbeTrigger(num, den, budget)
+
+
+class ProbeTrigger:
+    """
+    Decides when a single search probes a greedy solution (see ProbePolicy), keeping the probes left in its budget.
+    """
+
+    __slots__ = ("num", "den", "left")
+
+    def __init__(self, num, den, budget = None):
+        """
+        Constructs a trigger.
+        :param num: numerator of the ratio r
+        :param den: denominator of the ratio r
+        :param budget: maximum number of probes (None for no limit)
+        """
+        self.num = num
+        self.den = den
+        self.left = budget
 
-    def __le__(self, other):
-        return self._min <= other._min or self._min == other._min and self._expression[-1] <= other._expression[-1]
+    def fire(self, count, min_count):
+        """
+        Checks whether a greedy solution should be probed from a node and counts it if so.
+        :param count: number of primes of the best solution found
+        :param min_count: lower bound of the node
+        :return: True if the solution should be probed
+        """
+        if count * self.den < min_count * self.num or self.left == 0:
+            return False
+        if self.left is not None:
+            self.left -= 1
+        return True
 
-    def __gt__(self, other):
-        return not (self <= other)
 
-    def __ge__(self, other):
-        return not (self < other)
+def read_probe_policy(filename):
+    """
+    Reads the probe policy written by write_probe_policy.
+    :param filename: name of the JSON file with the policy
+    :return: a ProbePolicy with the settings in the file, or the default one if the file doesn't exist
+    """
+    try:
+        with open(filename, 'r') as file:
+            settings = json.load(file)
+            file.close()
+    except FileNotFoundError:
+        return ProbePolicy()
+    return ProbePolicy({int(magnitude): tuple(setting) for magnitude, setting in settings.items()})
 
 
-def find_expression(n, primes, prime):
+def write_probe_policy(filename, policy):
+    """
+    Writes a probe policy in a JSON file so it's read at startup.
+    :param filename: name of the JSON file
+    :param policy: ProbePolicy to be written
+    :return: nothing
+    """
+    with open(filename, 'w') as file:
+        json.dump({str(magnitude): list(setting) for magnitude, setting in policy.settings.items()}, file, indent = 4)
+        file.close()
+
+
+""" Policy that decides when the searches of this process probe greedy solutions """
+PROBE_POLICY = read_probe_policy(PROBE_FILENAME)
+
+
+""" Dictionary that maps every prime number with the quotients solved by this process if we don't use that prime
+    number, each one with its best expression and count, from the least to the most recently used """
+SUBPROBLEMS = {p: OrderedDict() for p in PRIMES}
+
+
+def find_expression(n, primes, prime, deadline = None, stats = None):
     """
     Main algorithm to solve the problem. Finds the expression with primes in primes excluding prime that evaluates to n.
-    Returns the string with the formula and the number of primes involved.
+    Returns the string with the formula and the number of primes involved. If a deadline is given and it is reached
+    before the search finishes, the best expression found so far is returned instead.
     :param n: target number to be decomposed
     :param primes: ordered list with all available primes
     :param prime: unused prime
+    :param deadline: time() value at which the search must stop (None to search until the end)
+    :param stats: SearchStats where the statistics of this search are added (None to not collect them)
     :return: a pair (expression, count), where expression is a string with an evaluable expression that evaluates to
     n and count is the number of primes used in the expression
     """
@@ -142,96 +453,410 @@ def find_expression(n, primes, prime):
     if n in prime_set:
         return f"{n}", 1
     unreachable = UNREACHABLE[prime]
-    if n < MIN_NON_DECOMPOSABLE:
-        expression, count = decompose(n, prime_set, unreachable)
+    costs = COST_TABLE[prime] if COST_TABLE else None
+    # Every number below ceiling has a known optimal decomposition
+    ceiling = max(len(costs), MIN_NON_DECOMPOSABLE) if costs else MIN_NON_DECOMPOSABLE
+    if n < ceiling:
+        expression, count = table_decompose(n, costs, prime, prime_set, unreachable)
         return "".join(reversed(expression)), count
-    expression_result = []
-    operand_count_result = n + 1
-    valid_result = False
+    # Quotients solved in previous test cases
+    solved = SUBPROBLEMS[prime]
+    if n in solved:
+        solved.move_to_end(n)
+        return solved[n]
+    # Numbers with few primes found bottom-up
+    count = get_meet_layer(prime).get(n)
+    if count:
+        return get_expression((None, n), costs, prime, prime_set, unreachable), count
+    # Only actual searches are measured, once the tables built on demand are ready
+    get_divisor_plan(prime)
+    if stats is not None:
+        stats.searches += 1
+        start_time = time()
+    # Start from a greedy solution so there is always something to return when the deadline is reached
+    expression_result, operand_count_result = \
+        find_portfolio_solution(n, primes, prime, prime_set, unreachable, costs, stats)
+    if stats is not None:
+        stats.first_solution_time += time() - start_time
+        solution_time = time()
+    if BEAM_WIDTH is not None:
+        search = beam_search
+    else:
+        search = iterative_deepening_search if ITERATIVE_DEEPENING else best_first_search
+    expression_result, operand_count_result, complete, last_solution_time = \
+        search(n, (expression_result, operand_count_result), primes, prime, prime_set, unreachable, costs, deadline,
+               stats)
+    if stats is not None:
+        if last_solution_time is not None:
+            solution_time = last_solution_time
+        stats.solution_time += solution_time - start_time
+        stats.max_solution_time = max(stats.max_solution_time, solution_time - start_time)
+    # An incomplete search may not have found the best expression
+    subproblems = [] if complete else None
+    expression_result = get_expression(expression_result, costs, prime, prime_set, unreachable, solved, subproblems)
+    if complete:
+        save_subproblems(subproblems, solved, ceiling)
+    return expression_result, operand_count_result
+
+
+def best_first_search(n, result, primes, prime, prime_set, unreachable, costs, deadline = None, stats = None):
+    """
+    Default search engine of find_expression. It expands the nodes in increasing order of their lower bound, so the
+    first time that bound reaches the count of the best solution found the search is over. Every node in the queue is
+    kept in memory until it's expanded.
+    :param n: target number to be decomposed (must be above the table ceiling and out of the meet layer)
+    :param result: pair (expression, count) with the best solution known, where expression is a linked expression
+    :param primes: ordered list with all available primes
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param deadline: time() value at which the search must stop (None to search until the end)
+    :param stats: SearchStats where the statistics of this search are added (None to not collect them)
+    :return: a tuple (expression, count, complete, solution_time) where expression is the best linked expression
+    found, count the number of primes it uses, complete is False if the deadline was reached and solution_time is the
+    time() value when that solution was found (None if it's the given one or stats is None)
+    """
+    trigger = PROBE_POLICY.trigger(n)
+    solution_time = None
+    complete = True
     seen = dict()
-    queue = [Node([f"{n}"], 1, 1, 1)]
+    max_prime = primes[-1] if prime != primes[-1] else primes[-2]
+    powers = [max_prime ** c for c in range(1, MAX_POWER)]
+    # Every node is a tuple (lower bound, current number, count, steps) where steps are the linked steps (see
+    # get_expression) that lead to the current number, which is kept as an integer. The lower bound and the current
+    # number identify a node as a number is pushed again only if its count is lower
+    queue = [(1, n, 1, None)]
     while queue:
-        node = heappop(queue)
-        depth = node.depth()
-        count = node.count()
+        # Out of time: return the best solution found so far
+        if deadline is not None and time() >= deadline:
+            complete = False
+            break
+        min_count, current, count, expression = heappop(queue)
+        # Nodes are sorted by their lower bound, so none of the remaining ones can lead to a better solution
+        if min_count >= result[1]:
+            break
+        if stats is not None:
+            stats.popped += 1
         # Won't get a better solution; prune this branch
-        if count > operand_count_result or count == operand_count_result and valid_result:
+        if count >= result[1]:
+            if stats is not None:
+                stats.count_prunes += 1
             continue
-        expression = node.expression()
-        current = int(expression.pop())
         # seen[current] has been updated in other branch and now there's a better result for current
         if current in seen and count - 1 > seen[current]:
+            if stats is not None:
+                stats.seen_prunes += 1
+            continue
+        best_count = result[1]
+        children, result = expand_node(current, count, expression, result, primes, prime, prime_set, unreachable,
+                                       costs, powers, seen, trigger, stats)
+        # New nodes to the tree
+        for child in children:
+            heappush(queue, child)
+        if stats is not None:
+            stats.pushed += len(children)
+            if result[1] < best_count:
+                solution_time = time()
+    return result[0], result[1], complete, solution_time
+
+
+def iterative_deepening_search(n, result, primes, prime, prime_set, unreachable, costs, deadline = None, stats = None):
+    """
+    Memory-bounded search engine of find_expression (see ITERATIVE_DEEPENING). It's a depth-first search that only
+    expands the nodes whose lower bound is up to a threshold. The threshold starts at the lower bound of n and every
+    iteration raises it to the lowest bound that exceeded it, until a solution within the threshold is found, which is
+    the best one. Only the children of the nodes in the current path are kept in memory, along with up to
+    TRANSPOSITION_SIZE seen quotients.
+    :param n: target number to be decomposed (must be above the table ceiling and out of the meet layer)
+    :param result: pair (expression, count) with the best solution known, where expression is a linked expression
+    :param primes: ordered list with all available primes
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param deadline: time() value at which the search must stop (None to search until the end)
+    :param stats: SearchStats where the statistics of this search are added (None to not collect them)
+    :return: a tuple (expression, count, complete, solution_time) as returned by best_first_search
+    """
+    solution_time = None
+    max_prime = primes[-1] if prime != primes[-1] else primes[-2]
+    powers = [max_prime ** c for c in range(1, MAX_POWER)]
+    seen = dict()
+    trigger = PROBE_POLICY.trigger(n)
+    # n is out of the meet layer, so it needs more primes than any number in it
+    threshold = 1 + max(estimation(n, primes, prime), get_meet_layer(prime).cost)
+    while threshold < result[1]:
+        # Quotients seen with a lower threshold may have to be expanded again
+        seen.clear()
+        next_threshold = result[1]
+        # Every level of the path keeps an iterator over the children of its node (see expand_node)
+        stack = [iter([(threshold, n, 1, None)])]
+        while stack:
+            # Out of time: return the best solution found so far
+            if deadline is not None and time() >= deadline:
+                return result[0], result[1], False, solution_time
+            node = next(stack[-1], None)
+            if node is None:
+                stack.pop()
+                continue
+            min_count, current, count, expression = node
+            # Children are sorted by their lower bound, so their remaining siblings won't get a better solution either
+            if min_count >= result[1]:
+                stack.pop()
+                continue
+            if min_count > threshold:
+                next_threshold = min(next_threshold, min_count)
+                stack.pop()
+                continue
+            # seen[current] has been updated in other branch and now there's a better result for current
+            if current in seen and count - 1 > seen[current]:
+                if stats is not None:
+                    stats.seen_prunes += 1
+                continue
+            if stats is not None:
+                stats.popped += 1
+            best_count = result[1]
+            children, result = expand_node(current, count, expression, result, primes, prime, prime_set, unreachable,
+                                           costs, powers, seen, trigger, stats)
+            if stats is not None:
+                stats.pushed += len(children)
+                if result[1] < best_count:
+                    solution_time = time()
+            # Forgetting seen quotients only makes the search repeat some branches
+            if len(seen) > TRANSPOSITION_SIZE:
+                seen.clear()
+            stack.append(iter(children))
+        threshold = next_threshold
+    return result[0], result[1], True, solution_time
+
+
+def beam_search(n, result, primes, prime, prime_set, unreachable, costs, deadline = None, stats = None):
+    """
+    Fast search engine of find_expression (see BEAM_WIDTH). It expands the nodes level by level and only keeps the
+    BEAM_WIDTH children of every level with the lowest bound, so the result may not be the best one. The lowest bound
+    of the discarded nodes is still a lower bound of the best solution, and the gap between both is added to the
+    statistics.
+    :param n: target number to be decomposed (must be above the table ceiling and out of the meet layer)
+    :param result: pair (expression, count) with the best solution known, where expression is a linked expression
+    :param primes: ordered list with all available primes
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param deadline: time() value at which the search must stop (None to search until the end)
+    :param stats: SearchStats where the statistics of this search are added (None to not collect them)
+    :return: a tuple (expression, count, complete, solution_time) as returned by best_first_search, where complete is
+    only True if no node that could improve the result was discarded
+    """
+    solution_time = None
+    max_prime = primes[-1] if prime != primes[-1] else primes[-2]
+    powers = [max_prime ** c for c in range(1, MAX_POWER)]
+    seen = dict()
+    trigger = PROBE_POLICY.trigger(n)
+    # Lowest bound of the discarded nodes: a better solution could only come from one of them
+    lower_bound = result[1]
+    # n is out of the meet layer, so it needs more primes than any number in it
+    level = [(1 + max(estimation(n, primes, prime), get_meet_layer(prime).cost), n, 1, None)]
+    out_of_time = False
+    while level and not out_of_time:
+        children = []
+        for min_count, current, count, expression in level:
+            # Out of time: the remaining nodes and the children found are discarded too
+            if deadline is not None and time() >= deadline:
+                out_of_time = True
+                lower_bound = min([lower_bound, min_count] + [child[0] for child in children])
+                break
+            # Nodes are sorted by their lower bound, so none of the remaining ones can lead to a better solution
+            if min_count >= result[1]:
+                break
+            if stats is not None:
+                stats.popped += 1
+            best_count = result[1]
+            new_children, result = expand_node(current, count, expression, result, primes, prime, prime_set,
+                                               unreachable, costs, powers, seen, trigger, stats)
+            children += new_children
+            if stats is not None:
+                stats.pushed += len(new_children)
+                if result[1] < best_count:
+                    solution_time = time()
+        # Only the best children are kept for the next level
+        level = sorted(child for child in children if child[0] < result[1])
+        if len(level) > BEAM_WIDTH:
+            lower_bound = min(lower_bound, level[BEAM_WIDTH][0])
+            del level[BEAM_WIDTH:]
+    lower_bound = min(lower_bound, result[1])
+    if stats is not None:
+        stats.beam_gap += result[1] - lower_bound
+        stats.max_beam_gap = max(stats.max_beam_gap, result[1] - lower_bound)
+    return result[0], result[1], lower_bound == result[1], solution_time
+
+
+def expand_node(current, count, expression, result, primes, prime, prime_set, unreachable, costs, powers, seen,
+                trigger, stats = None):
+    """
+    Expands a node of any search engine: children that reach a number with a known decomposition are taken as
+    solutions, greedy solutions are probed from the promising ones and the rest are returned unless their lower bound
+    shows they can't improve the result.
+    :param current: number of the node (must be above the table ceiling)
+    :param count: count of primes used to reach current, including one for current itself
+    :param expression: linked steps that lead to current (None if current is the target number)
+    :param result: pair (expression, count) with the best solution known, where expression is a linked expression
+    :param primes: ordered list with all available primes
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param powers: list with the powers of the maximum valid prime, from 1 up to MAX_POWER (excluded)
+    :param seen: dictionary that maps every seen quotient to its minimal path length
+    :param trigger: ProbeTrigger that decides when greedy solutions are probed
+    :param stats: SearchStats where the statistics of this search are added (None to not collect them)
+    :return: a pair (children, result) where children is a list with the nodes (lower bound, quotient, count, steps)
+    that may improve the result sorted by their lower bound, and result is the best solution found (the given one if
+    none is better)
+    """
+    expression_result, operand_count_result = result
+    ceiling = max(len(costs), MIN_NON_DECOMPOSABLE) if costs else MIN_NON_DECOMPOSABLE
+    solved = SUBPROBLEMS[prime]
+    layer = get_meet_layer(prime)
+    children = []
+    for p, bound, candidates in get_divisor_plan(prime):
+        # Any child needs at least one prime for the quotient and the ones given by its magnitude, so only remainders
+        # with a cost up to the gap left by the current result can improve it. This narrows the window to multiples of
+        # p or prime remainders when the gap is small (current >= ceiling, so it is greater than every divisor)
+        min_quot = (current - bound) // p
+        max_extra = operand_count_result - 1 - count - (1 + bisect_left(powers, min_quot) if min_quot > 1 else 0)
+        if max_extra < 0:
+            if stats is not None:
+                stats.count_prunes += sum(len(group) for group in candidates[current % p])
             continue
-        for p in primes:
-            # Ignore removed prime or 1
-            if p == prime or p == 1:
+        for new_count, quot, rem in get_possible_remainders(p, current, count, candidates, seen, stats, max_extra):
+            if quot != 1:
+                new_count += 1
+            new_expression = (expression, p, rem)
+            # No solution here: prune branch
+            if new_count >= operand_count_result:
+                if stats is not None:
+                    stats.count_prunes += 1
+                continue
+            # Finished
+            if quot == 1 or quot in prime_set:
+                expression_result = (new_expression, quot)
+                operand_count_result = new_count
                 continue
-            # Can't do current / p
-            if p > current:
+            if quot < ceiling:
+                quot_count = table_cost(quot, costs, prime_set, unreachable)
+            else:
+                quot_count = layer.get(quot) or (solved[quot][1] if quot in solved else 0)
+            if quot_count:
+                new_count += quot_count - 1
+                if new_count < operand_count_result:
+                    expression_result = (new_expression, quot)
+                    operand_count_result = new_count
+                continue
+            # Numbers out of the meet layer need more primes than any number in it
+            min_count = new_count + max(estimation(quot, primes, prime), layer.cost)
+            # Won't get a better solution
+            if min_count >= operand_count_result:
+                if stats is not None:
+                    stats.bound_prunes += 1
                 continue
-            bound = get_remainders_bound(p, PRIMES[-1], MIN_NON_DECOMPOSABLE)
-            remainders = get_possible_remainders(p, current, count, bound, prime_set, seen, unreachable)
-            while remainders:
-                new_count, quot, rem = heappop(remainders)
-                # If it's not remainder it is excess
-                is_remainder = p * quot + rem == current
-                new_expression = expression.copy()
-                new_expression.append(")")
-                if rem != 0:
-                    if rem in prime_set:
-                        new_expression.append(f"{rem}")
-                    else:
-                        expr, _ = decompose(rem, prime_set, unreachable)
-                        new_expression.append(")")
-                        new_expression.extend(expr)
-                        new_expression.append("(")
-                    new_expression.append("+" if is_remainder else "-")
-                new_expression.append(f"{p}")
-                if quot != 1:
-                    new_expression.append("*")
-                    new_expression.append(f"{quot}")
-                    new_count += 1
-                # No solution here: prune branch
-                if new_count > operand_count_result or new_count == operand_count_result and valid_result:
-                    continue
-                # Finished
-                if quot == 1 or quot in prime_set:
-                    if new_count <= operand_count_result:
-                        expression_result = new_expression + (["("] * depth)
-                        operand_count_result = new_count
-                        valid_result = True
-                    continue
-                if quot < MIN_NON_DECOMPOSABLE:
-                    # Remove the quotient previously added
-                    new_expression.pop()
-                    expr, extra = decompose(quot, prime_set, unreachable)
-                    new_expression.append(")")
-                    new_expression.extend(expr)
-                    new_expression.append("(")
-                    new_count += extra - 1
-                    if new_count <= operand_count_result:
-                        expression_result = new_expression + (["("] * depth)
-                        operand_count_result = new_count
-                        valid_result = True
-                    continue
-                min_count = new_count + estimation(quot, primes, prime)
-                # Won't get a better solution
-                if min_count > operand_count_result or min_count == operand_count_result and valid_result:
-                    continue
-                if operand_count_result * DEN >= min_count * NUM:
-                    expr, max_count = find_random_solution(quot, primes, prime, len(primes) - 1, prime_set, unreachable)
-                    max_count += new_count
-                    # Update the solution with new one but don't prune this branch
-                    if max_count < operand_count_result:
-                        temp = new_expression.copy()
-                        temp.pop()
-                        temp.extend(expr)
-                        expression_result = temp + (["("] * depth)
-                        operand_count_result = max_count
-                        valid_result = True
-                # New node to the tree
-                heappush(queue, Node(new_expression, depth + 1, new_count, min_count))
-    return "".join(reversed(expression_result)), operand_count_result
+            if trigger.fire(operand_count_result, min_count):
+                expr, max_count = find_random_solution(quot, primes, prime, len(primes) - 1, prime_set, unreachable,
+                                                       costs, new_expression)
+                max_count += new_count
+                if stats is not None:
+                    stats.probes += 1
+                if max_count < operand_count_result:
+                    expression_result = expr
+                    operand_count_result = max_count
+            children.append((min_count, quot, new_count, new_expression))
+    children.sort()
+    return children, (expression_result, operand_count_result)
+
+
+def get_expression(expression, costs, prime, prime_set, unreachable, solved = None, subproblems = None):
+    """
+    Builds the string of a linked expression. The search only keeps the steps n = p * quot + rem of every node linked
+    to the steps of its parent, so the string is only built for the final solution. A linked expression is a pair
+    (steps, quot) where steps is either None or a triplet (parent steps, p, rem), rem being negative if it's an excess,
+    and quot is the last quotient, which must be 1, a valid prime, a solved quotient, a number in the cost table or a
+    number in the meet layer.
+    :param expression: a linked expression
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :param solved: dictionary that maps every solved quotient with its expression and count (None if there are none)
+    :param subproblems: list where a triplet (quot, expression, count) is appended for every quotient in the steps,
+    from the innermost one, with the part of the expression that evaluates to it (None to not collect them)
+    :return: a string with an evaluable expression
+    """
+    steps, quot = expression
+    # Numbers from the meet layer are divided until they reach the table
+    layer = get_meet_layer(prime)
+    while layer.get(quot):
+        p, quot, rem = meet_split(quot, costs, prime, prime_set, unreachable)
+        steps = (steps, p, rem)
+    divisions = []
+    while steps is not None:
+        steps, p, rem = steps
+        divisions.append((p, rem))
+    if quot == 1:
+        expression, count = "", 0
+    elif quot in prime_set:
+        expression, count = f"{quot}", 1
+    elif solved and quot in solved:
+        # Already enclosed in parentheses
+        expression, count = solved[quot]
+        solved.move_to_end(quot)
+    else:
+        expr, count = table_decompose(quot, costs, prime, prime_set, unreachable)
+        expression = "(" + "".join(reversed(expr)) + ")"
+    parts = ["(" * len(divisions), expression]
+    # Innermost division first
+    for i, (p, rem) in enumerate(divisions):
+        parts.append(f"*{p}" if parts[-1] else f"{p}")
+        quot = p * quot + rem
+        count += 1
+        if rem != 0:
+            parts.append("+" if rem > 0 else "-")
+            rem = abs(rem)
+            if rem in prime_set:
+                parts.append(f"{rem}")
+                count += 1
+            else:
+                expr, rem_count = decompose(rem, prime_set, unreachable)
+                parts.append("(" + "".join(reversed(expr)) + ")")
+                count += rem_count
+        parts.append(")")
+        if subproblems is not None:
+            # Only the last i + 1 leading parentheses belong to this quotient
+            subproblems.append((quot, "(" * (i + 1) + "".join(parts[1:]), count))
+    return "".join(parts)
+
+
+def save_subproblems(subproblems, solved, ceiling):
+    """
+    Saves every quotient in the path of the given solution with the part of the expression that evaluates to it. As the
+    solution is the best one found, the rest of its path is the best one found for the quotient too. When there are
+    more than SUBPROBLEM_SIZE quotients the least recently used ones are evicted.
+    :param subproblems: list with the triplets (quot, expression, count) collected by get_expression
+    :param solved: OrderedDict that maps every solved quotient with its expression and count
+    :param ceiling: quotients below this number are not saved as they are already in the cost table
+    :return: nothing
+    """
+    for quot, expression, count in subproblems:
+        if quot >= ceiling:
+            solved[quot] = expression, count
+            solved.move_to_end(quot)
+    while len(solved) > SUBPROBLEM_SIZE:
+        solved.popitem(last = False)
 
 
 def get_remainders_bound(p, lower_bound, upper_bound):
@@ -247,49 +872,81 @@ def get_remainders_bound(p, lower_bound, upper_bound):
     return (num * upper_bound + (den - num) * lower_bound) / den
 
 
-def get_possible_remainders(p, current, count, bound, prime_set, seen, unreachable):
+""" Dictionary that maps every prime number with the divisors (and the candidate remainders for every division) that
+    are used to decompose a number if we don't use that prime number. It's filled on demand by get_divisor_plan """
+DIVISOR_PLANS = {}
+
+
+def get_divisor_plan(prime):
     """
-    Returns a heap with all possible "remainders" we're considering (from -bound to bound inclusive):
-    current = p * quot + rem.
+    Returns the divisors that can be used to decompose a number if we removed prime, computing them only the first
+    time. For every divisor p it also keeps the "remainders" considered in the division n/p for every possible value of
+    n % p, grouped by the number of primes they need, so expanding a node only needs one division for each divisor.
+    :param prime: unused prime
+    :return: a tuple of triplets (p, bound, candidates) for every prime but 1 and prime, where bound is the integer part
+    of get_remainders_bound for p and candidates[n % p][c] is a tuple with the pairs (offset, rem) in increasing order
+    of offset such that n = p * (n // p + offset) + rem, |rem| <= bound and rem needs c primes
+    """
+    if prime in DIVISOR_PLANS:
+        return DIVISOR_PLANS[prime]
+    rem_costs = REMAINDER_COSTS[prime]
+    plan = []
+    for p in PRIMES:
+        if p == prime or p == 1:
+            continue
+        bound = int(get_remainders_bound(p, PRIMES[-1], MIN_NON_DECOMPOSABLE))
+        candidates = []
+        for mod in range(p):
+            groups = ([], [], [], [])
+            # n = p * (n // p - k) + mod + k * p, from the largest remainder down
+            for k in range((bound - mod) // p, -1, -1):
+                groups[rem_costs[mod + k * p]].append((-k, mod + k * p))
+            # n = p * (n // p + k + 1) - (p - mod + k * p)
+            for k in range((bound - p + mod) // p + 1):
+                groups[rem_costs[p - mod + k * p]].append((k + 1, -(p - mod + k * p)))
+            candidates.append(tuple(tuple(group) for group in groups))
+        plan.append((p, bound, tuple(candidates)))
+    DIVISOR_PLANS[prime] = tuple(plan)
+    return DIVISOR_PLANS[prime]
+
+
+def get_possible_remainders(p, current, count, candidates, seen, stats = None, max_extra = 3):
+    """
+    Returns all possible "remainders" we're considering, sorted by count: current = p * quot + rem.
     :param p: prime divisor
     :param current: dividend
     :param count: current count of primes used
-    :param bound: absolute value of maximum remainder
-    :param prime_set: set containing all valid primes
+    :param candidates: remainders considered for p for every value of current % p (see get_divisor_plan)
     :param seen: dictionary that maps every seen quotient to its minimal path length
-    :param unreachable: set with all non-decomposable numbers in this conditions between 1 and 97 with 2 primes
-    :return: a list representing a heap of triplets (count, quotient, remainder) where count is the number of primes
-    used in the decomposition current = p * quotient + remainder plus the previous count at this point
+    :param stats: SearchStats where discarded remainders are counted (None to not count them)
+    :param max_extra: remainders that need more primes than this are not considered (3 by default, so all are)
+    :return: a sorted list of triplets (count, quotient, remainder) where count is the number of primes used in the
+    decomposition current = p * quotient + remainder plus the previous count at this point (remainder is negative if
+    it's an excess)
     """
-    # current = quot * p + rem
+    # Candidates are grouped by the primes their remainder needs and sorted by quotient within every group, so this
+    # is the same order as sorting the triplets
     remainders = []
-    quot = current // p
-    rem = current % p
-    while rem <= bound:
-        new_count = count
-        if rem != 0:
-            new_count += 1 if rem in prime_set else 2 if rem not in unreachable else 3
-        # Add to heap only if we can find a better solution
-        if quot not in seen or seen[quot] > new_count:
-            seen[quot] = new_count
-            heappush(remainders, (new_count, quot, rem))
-        rem += p
-        quot -= 1
-    # current = quot * p - rem
-    quot = current // p + 1
-    rem = p - (current % p)
-    while rem <= bound:
-        # rem != 0 for sure
-        new_count = count + (1 if rem in prime_set else 2 if rem not in unreachable else 3)
-        if quot not in seen or seen[quot] > new_count:
-            seen[quot] = new_count
-            heappush(remainders, (new_count, quot, rem))
-        rem += p
-        quot += 1
+    quot, mod = divmod(current, p)
+    for extra, group in enumerate(candidates[mod]):
+        if extra > max_extra:
+            # Remainders out of the window are pruned by count
+            if stats is not None:
+                stats.count_prunes += sum(len(group) for group in candidates[mod][extra:])
+            break
+        new_count = count + extra
+        for offset, rem in group:
+            # Add only if we can find a better solution
+            if quot + offset not in seen or seen[quot + offset] > new_count:
+                seen[quot + offset] = new_count
+                remainders.append((new_count, quot + offset, rem))
+            elif stats is not None:
+                stats.seen_prunes += 1
     return remainders
 
 
-def find_random_solution(n, primes, prime, index, prime_set, unreachable):
+def find_random_solution(n, primes, prime, index, prime_set, unreachable, costs = None, expression = None,
+                         excess = False):
     """
     Returns a solution of the problem using the same algorithm but only with the prime at index or lower so it can
     find a solution faster than the real algorithm.
@@ -298,16 +955,21 @@ def find_random_solution(n, primes, prime, index, prime_set, unreachable):
     :param prime: unused prime
     :param index: index in primes for the prime that will be used to decompose n
     :param prime_set: set containing all valid primes
-    :param unreachable: set with all non-decomposable numbers between 1 and 97 with 2 primes in this conditions
-    :return: a list containing a valid expression that evaluates to n
+    :param unreachable: mask of all non-decomposable numbers between 1 and 97 with 2 primes in this conditions
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param expression: linked steps that lead to n (None if n is the target number)
+    :param excess: whether an excess over the next multiple of the divisor is used when it needs less primes than the
+    remainder (False by default)
+    :return: a pair (expression, count) where expression is a linked expression (see get_expression) that continues
+    the given steps until n is decomposed and count is the number of primes used to decompose n
     """
+    ceiling = max(len(costs), MIN_NON_DECOMPOSABLE) if costs else MIN_NON_DECOMPOSABLE
+    layer = get_meet_layer(prime)
+    rem_costs = REMAINDER_COSTS[prime]
     div = primes[index] if primes[index] != prime else primes[index - 1]
     count = 1
-    depth = 0
-    expression = [f"{n}"]
     finished = False
     while not finished:
-        n = int(expression.pop())
         while n < div:
             index = index - 1
             if primes[index] == prime:
@@ -315,40 +977,94 @@ def find_random_solution(n, primes, prime, index, prime_set, unreachable):
             div = primes[index]
         quot = n // div
         rem = n % div
-        expression.append(")")
-        depth += 1
-        if rem != 0:
-            if rem in prime_set:
-                expression.append(f"{rem}")
-                count += 1
-            # We will find a two-operand decomposition for sure
-            else:
-                expr = decompose2(rem, prime_set)
-                expression.append(")")
-                expression.extend(expr)
-                expression.append("(")
-                count += 2
-            expression.append("+")
-        expression.append(f"{div}")
+        if excess and rem != 0 and rem_costs[div - rem] < rem_costs[rem]:
+            quot += 1
+            rem -= div
+        expression = (expression, div, rem)
+        count += rem_costs[abs(rem)]
         if quot != 1:
-            expression.append("*")
-            expression.append(f"{quot}")
             count += 1
         # Finished
         if quot == 1 or quot in prime_set:
-            expression.extend(["("] * depth)
             finished = True
-        elif quot < MIN_NON_DECOMPOSABLE:
-            # Remove the quotient previously added
-            expression.pop()
-            expr, extra = decompose(quot, prime_set, unreachable)
-            expression.append(")")
-            expression.extend(expr)
-            expression.append("(")
-            expression.extend(["("] * depth)
-            count += extra - 1
+        elif quot < ceiling or layer.get(quot):
+            count += (table_cost(quot, costs, prime_set, unreachable) if quot < ceiling else layer.get(quot)) - 1
             finished = True
-    return expression, count
+        n = quot
+    return (expression, n), count
+
+
+def find_mixed_solution(n, primes, prime, prime_set, unreachable, costs = None, expression = None):
+    """
+    Returns a solution of the problem choosing at every step the division n = p * quot + rem by any valid prime p, with
+    either a remainder or an excess, that needs the least primes for rem plus the ones given by the magnitude of quot,
+    and the lowest quot among them.
+    :param n: target number
+    :param primes: ordered list with all available primes
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers between 1 and 97 with 2 primes in this conditions
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param expression: linked steps that lead to n (None if n is the target number)
+    :return: a pair (expression, count) as returned by find_random_solution
+    """
+    ceiling = max(len(costs), MIN_NON_DECOMPOSABLE) if costs else MIN_NON_DECOMPOSABLE
+    layer = get_meet_layer(prime)
+    rem_costs = REMAINDER_COSTS[prime]
+    max_prime = primes[-1] if prime != primes[-1] else primes[-2]
+    powers = [max_prime ** c for c in range(1, MAX_POWER)]
+    count = 1
+    while True:
+        best = None
+        for p, _, _ in get_divisor_plan(prime):
+            if p > n:
+                break
+            quot, rem = divmod(n, p)
+            for q, r in ((quot, rem), (quot + 1, rem - p)):
+                score = (rem_costs[abs(r)] + bisect_left(powers, q), q)
+                if best is None or score < best[0]:
+                    best = score, p, q, r
+        _, p, quot, rem = best
+        expression = (expression, p, rem)
+        count += rem_costs[abs(rem)]
+        if quot != 1:
+            count += 1
+        # Finished
+        if quot == 1 or quot in prime_set:
+            break
+        if quot < ceiling or layer.get(quot):
+            count += (table_cost(quot, costs, prime_set, unreachable) if quot < ceiling else layer.get(quot)) - 1
+            break
+        n = quot
+    return (expression, quot), count
+
+
+def find_portfolio_solution(n, primes, prime, prime_set, unreachable, costs = None, stats = None):
+    """
+    Returns the best of several greedy solutions of the problem: find_random_solution starting from each of the
+    PORTFOLIO_SIZE greatest valid primes, with and without excesses, and find_mixed_solution.
+    :param n: target number
+    :param primes: ordered list with all available primes
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers between 1 and 97 with 2 primes in this conditions
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param stats: SearchStats where the greedy solutions are counted as probes (None to not count them)
+    :return: a pair (expression, count) as returned by find_random_solution
+    """
+    results = []
+    index = len(primes) - 1
+    for _ in range(PORTFOLIO_SIZE):
+        if primes[index] == prime:
+            index -= 1
+        for excess in (False, True):
+            results.append(find_random_solution(n, primes, prime, index, prime_set, unreachable, costs,
+                                                 excess = excess))
+        index -= 1
+    results.append(find_mixed_solution(n, primes, prime, prime_set, unreachable, costs))
+    if stats is not None:
+        stats.probes += len(results)
+    return min(results, key = lambda result: result[1])
 
 
 def decompose(n, primes, unreachable):
@@ -356,12 +1072,12 @@ def decompose(n, primes, unreachable):
     Decompose the given number n in 2 or 3 primes assuming it's possible.
     :param n: target number to be decomposed (must ensure n < MIN_NON_DECOMPOSABLE)
     :param primes: set with all usable primes
-    :param unreachable: set with all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE with
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE with
     2 primes
     :return: a pair with a list with the correct expression that decomposes the target number n (or [] if couldn't
     decompose) and the number of primes used (2 or 3)
     """
-    return (decompose2(n, primes), 2) if n not in unreachable else \
+    return (decompose2(n, primes), 2) if not unreachable[n] else \
         (decompose3(n, primes, unreachable), 3)
 
 
@@ -373,7 +1089,7 @@ def decompose2(n, primes):
     :return: a list with the correct expression that decomposes the target number n with 2 primes or [] if couldn't
     decompose
     """
-    p, q = CROSS_PRODUCTS.get(n, (0, 0))
+    p, q = CROSS_PRODUCTS[n]
     if p in primes and q in primes:
         return [f"{q}", "*", f"{p}"]
     for p in primes:
@@ -394,12 +1110,14 @@ def decompose3(n, primes, unreachable):
     Decompose the given number n in 3 primes assuming it's possible.
     :param n: target number to be decomposed (must ensure n < MIN_NON_DECOMPOSABLE)
     :param primes: set with all usable primes
-    :param unreachable: set with all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
     with 2 primes
     :return: a list with the correct expression that decomposes the target number n with 3 primes or [] if couldn't
     decompose
     """
-    for x in NUMBERS.difference(unreachable):
+    for x in NUMBERS:
+        if unreachable[x]:
+            continue
         if x < n:
             q = n - x
             if q in primes:
@@ -412,40 +1130,382 @@ def decompose3(n, primes, unreachable):
     return []
 
 
+def table_decompose(n, costs, prime, prime_set, unreachable):
+    """
+    Decompose the given number n with the minimal amount of primes using the precomputed cost table.
+    :param n: target number to be decomposed (must ensure n < max(len(costs), MIN_NON_DECOMPOSABLE))
+    :param costs: precomputed costs for this prime from COST_TABLE (may be None if n < MIN_NON_DECOMPOSABLE)
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :return: a pair with a list with the correct expression that decomposes the target number n and the number of
+    primes used
+    """
+    if n in prime_set:
+        return [f"{n}"], 1
+    if n < MIN_NON_DECOMPOSABLE:
+        return decompose(n, prime_set, unreachable)
+    count = costs[n]
+    expression = []
+    depth = 0
+    finished = False
+    while not finished:
+        p, quot, rem = table_split(n, costs, prime)
+        expression.append(")")
+        depth += 1
+        if rem != 0:
+            if abs(rem) in prime_set:
+                expression.append(f"{abs(rem)}")
+            else:
+                expr, _ = decompose(abs(rem), prime_set, unreachable)
+                expression.append(")")
+                expression.extend(expr)
+                expression.append("(")
+            expression.append("+" if rem > 0 else "-")
+        expression.append(f"{p}")
+        if quot == 1:
+            finished = True
+        elif quot in prime_set:
+            expression.append("*")
+            expression.append(f"{quot}")
+            finished = True
+        elif quot < MIN_NON_DECOMPOSABLE:
+            expr, _ = decompose(quot, prime_set, unreachable)
+            expression.append("*")
+            expression.append(")")
+            expression.extend(expr)
+            expression.append("(")
+            finished = True
+        else:
+            expression.append("*")
+            n = quot
+    expression.extend(["("] * depth)
+    return expression, count
+
+
+def table_cost(n, costs, prime_set, unreachable):
+    """
+    Returns the number of primes table_decompose would use to decompose n without building the expression.
+    :param n: target number (must ensure n < max(len(costs), MIN_NON_DECOMPOSABLE))
+    :param costs: precomputed costs for this prime from COST_TABLE (may be None if n < MIN_NON_DECOMPOSABLE)
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :return: the minimal number of primes needed to decompose n
+    """
+    if n in prime_set:
+        return 1
+    if n < MIN_NON_DECOMPOSABLE:
+        return 2 if not unreachable[n] else 3
+    return costs[n]
+
+
+def table_split(n, costs, prime):
+    """
+    Finds the division n = p * quot + rem used by build_cost_table to reach the cost of n in the table, so the table
+    doesn't need to store the expressions.
+    :param n: number to be divided (must ensure MIN_NON_DECOMPOSABLE <= n < len(costs))
+    :param costs: precomputed costs for this prime from COST_TABLE
+    :param prime: unused prime
+    :return: a triplet (p, quot, rem) such that n = p * quot + rem, where rem is negative if it's an excess
+    """
+    count = costs[n]
+    rem_costs = REMAINDER_COSTS[prime]
+    for p, bound, _ in get_divisor_plan(prime):
+        # n = quot * p + rem
+        quot = n // p
+        rem = n % p
+        while rem <= bound:
+            if (costs[quot] if quot != 1 else 0) + 1 + rem_costs[rem] == count:
+                return p, quot, rem
+            rem += p
+            quot -= 1
+        # n = quot * p - rem
+        quot = n // p + 1
+        rem = p - (n % p)
+        while rem <= bound:
+            if (costs[quot] if quot != 1 else 0) + 1 + rem_costs[rem] == count:
+                return p, quot, -rem
+            rem += p
+            quot += 1
+    raise ValueError(f"Cost table is not consistent for {n}")
+
+
+def build_cost_table(prime, ceiling):
+    """
+    Computes the minimal number of primes needed to decompose every number below ceiling if we removed prime, using
+    the same divisions n = p * quot + rem considered by find_expression. It's a dynamic programming over n as the cost
+    of n only depends on the cost of smaller quotients.
+    :param prime: unused prime
+    :param ceiling: first number that won't be in the table
+    :return: a bytearray costs where costs[n] is the minimal number of primes needed to decompose n
+    """
+    rem_costs = REMAINDER_COSTS[prime]
+    costs = bytearray(ceiling)
+    for n in range(min(ceiling, MIN_NON_DECOMPOSABLE)):
+        costs[n] = 2 if n == 0 else rem_costs[n]
+    # For every divisor and every n % p, pairs (offset, count) such that quot = n // p + offset is a valid quotient
+    # and count is the number of primes used by the divisor and the remainder
+    divisors = [(p, [[(offset, 1 + extra) for extra, group in enumerate(groups) for offset, _ in group]
+                     for groups in candidates])
+                for p, _, candidates in get_divisor_plan(prime)]
+    # A quotient of 1 doesn't add any prime (n = p + rem)
+    one_cost = costs[1]
+    costs[1] = 0
+    for n in range(MIN_NON_DECOMPOSABLE, ceiling):
+        costs[n] = min([costs[quot + offset] + count for p, plan in divisors for quot, rem in (divmod(n, p),)
+                        for offset, count in plan[rem]])
+    costs[1] = one_cost
+    return costs
+
+
+def write_cost_table(filename, ceiling, workers = None):
+    """
+    Builds the cost table for every prime number and writes it into the given file. The file contains, for every
+    prime in PRIMES in order, ceiling bytes with the cost of every number from 0 to ceiling - 1.
+    :param filename: name of the file where the table will be written
+    :param ceiling: first number that won't be in the table
+    :param workers: number of worker processes (NUM_WORKERS or the number of cores by default)
+    :return: nothing
+    """
+    workers = workers or NUM_WORKERS or cpu_count()
+    build = partial(build_cost_table, ceiling = ceiling)
+    with Pool(workers) as pool:
+        tables = pool.map(build, PRIMES, chunksize = 1)
+    with open(filename, 'wb') as file:
+        for table in tables:
+            file.write(table)
+        file.close()
+
+
+class MeetLayer:
+    """
+    Numbers above the table ceiling that can be decomposed with few primes if we don't use a prime (see
+    get_meet_layer). They are kept in a sorted array with a bytearray of their counts, so every number takes 9 bytes
+    and the worker processes forked after it's built share the same copy.
+    """
+
+    __slots__ = ("values", "counts", "cost", "max_value")
+
+    def __init__(self, layer, cost):
+        """
+        Constructs a layer.
+        :param layer: dictionary that maps every number in the layer with the minimal number of primes needed to
+        decompose it
+        :param cost: every number above the table ceiling that can be decomposed with this number of primes or less is
+        in the layer
+        """
+        self.values = array('q', sorted(layer))
+        self.counts = bytearray(layer[n] for n in self.values)
+        self.cost = cost
+        self.max_value = self.values[-1] if self.values else 0
+
+    def get(self, n):
+        """
+        Returns the count of a number in the layer.
+        :param n: number to look for
+        :return: the minimal number of primes needed to decompose n, or 0 if it's not in the layer
+        """
+        if n > self.max_value:
+            return 0
+        i = bisect_left(self.values, n)
+        return self.counts[i] if i < len(self.values) and self.values[i] == n else 0
+
+
+""" Dictionary that maps every prime number with the MeetLayer of the numbers above the table ceiling that can be
+    decomposed with few primes if we don't use that prime number. It's filled on demand by get_meet_layer """
+MEET_LAYERS = {}
+
+
+def get_meet_layer(prime):
+    """
+    Returns every number above the table ceiling that can be decomposed with MEET_COST or less primes if we removed
+    prime, computing them only the first time. They are found bottom-up, from the numbers in the table, with the same
+    divisions n = p * quot + rem considered by find_expression: a number with c primes is p * quot + rem with a quot
+    of less than c primes, so every level only needs the previous ones. Levels are added while the layer has no more
+    than MEET_SIZE numbers.
+    :param prime: unused prime
+    :return: a MeetLayer with every number above the table ceiling that can be decomposed with its cost or less primes
+    """
+    if prime in MEET_LAYERS:
+        return MEET_LAYERS[prime]
+    costs = COST_TABLE[prime] if COST_TABLE else build_cost_table(prime, MIN_NON_DECOMPOSABLE)
+    ceiling = len(costs)
+    rem_costs = REMAINDER_COSTS[prime]
+    # Quotients grouped by their count. A quotient of 1 doesn't add any prime (n = p + rem) and, if the ceiling is low,
+    # it can still reach numbers above it
+    quotients = [[] for _ in range(MEET_COST)]
+    if MEET_COST > 0:
+        quotients[0].append(1)
+    for n in range(2, ceiling):
+        if costs[n] < MEET_COST:
+            quotients[costs[n]].append(n)
+    layer = {}
+    cost = 0
+    for count in range(1, MEET_COST + 1):
+        found = {}
+        for p, bound, _ in get_divisor_plan(prime):
+            # Remainders of the window grouped by the primes they need
+            remainders = ([], [], [], [])
+            for rem in range(-bound, bound + 1):
+                remainders[rem_costs[abs(rem)]].append(rem)
+            # count = quot count + 1 (p) + remainder count
+            for quot_count in range(max(0, count - 4), count):
+                group = remainders[count - 1 - quot_count]
+                for quot in quotients[quot_count]:
+                    for rem in group:
+                        n = p * quot + rem
+                        if n >= ceiling and n not in layer:
+                            found[n] = count
+        # Only whole levels are kept, so numbers out of the layer need more than cost primes
+        if len(layer) + len(found) > MEET_SIZE:
+            break
+        layer.update(found)
+        cost = count
+        if count < MEET_COST:
+            quotients[count].extend(found)
+    MEET_LAYERS[prime] = MeetLayer(layer, cost)
+    return MEET_LAYERS[prime]
+
+
+def meet_split(n, costs, prime, prime_set, unreachable):
+    """
+    Finds the division n = p * quot + rem used by get_meet_layer to reach the count of n, as table_split does for the
+    cost table.
+    :param n: number to be divided (must be in the meet layer of prime)
+    :param costs: precomputed costs for this prime from COST_TABLE (None if there is no table)
+    :param prime: unused prime
+    :param prime_set: set containing all valid primes
+    :param unreachable: mask of all non-decomposable numbers in this conditions between 1 and MIN_NON_DECOMPOSABLE
+    with 2 primes
+    :return: a triplet (p, quot, rem) such that n = p * quot + rem, where rem is negative if it's an excess
+    """
+    layer = get_meet_layer(prime)
+    ceiling = max(len(costs), MIN_NON_DECOMPOSABLE) if costs else MIN_NON_DECOMPOSABLE
+    count = layer.get(n)
+    for p, bound, candidates in get_divisor_plan(prime):
+        quot, mod = divmod(n, p)
+        for extra, group in enumerate(candidates[mod]):
+            for offset, rem in group:
+                if quot + offset == 1:
+                    quot_count = 0
+                elif quot + offset < ceiling:
+                    quot_count = table_cost(quot + offset, costs, prime_set, unreachable)
+                else:
+                    quot_count = layer.get(quot + offset) or layer.cost + 1
+                if quot_count + 1 + extra == count:
+                    return p, quot + offset, rem
+    raise ValueError(f"Meet layer is not consistent for {n}")
+
+
 def estimation(n, primes, prime):
     """
-    Returns a lower bound of the primes needed to decompose n. We assume we can divide the given number by the
-    maximum available prime and get no remainder every time.
+    Returns a lower bound of the primes needed to decompose n apart from the one counted for n itself. The greatest
+    number reached with c primes is max_prime ** c, while any expression with c primes and a sum or a difference can't
+    go beyond 2 * max_prime ** (c - 1) (reached with (max_prime + max_prime) * max_prime ** (c - 2)). So if n is above
+    that and isn't the product of c primes it needs one more prime.
     :param n: target number to decompose with primes
     :param primes: ordered list with the available primes
     :param prime: unused prime
     :return: a lower bound of the number of primes needed to decompose the target number n
     """
     max_prime = primes[-1] if prime != primes[-1] else primes[-2]
-    x = n
-    min_count = 0
-    while x > max_prime:
-        x //= max_prime
+    # Minimum c such that n <= max_prime ** c
+    min_count = 1
+    power = max_prime
+    while power < n:
+        power *= max_prime
         min_count += 1
-    return min_count
+    # Every factor of such a product is at least n / max_prime ** (min_count - 1)
+    if n > 2 * (power // max_prime) and not is_product(n, min_count, primes, prime, n // (power // max_prime)):
+        min_count += 1
+    return min_count - 1
 
 
-def read_file(filename):
+def is_product(n, count, primes, prime, lowest = 2):
     """
-    Reads the file given the filename assuming it has the contest structure.
+    Checks whether n is the product of count or less primes.
+    :param n: number to be checked
+    :param count: maximum number of factors
+    :param primes: ordered list with the available primes
+    :param prime: unused prime
+    :param lowest: primes below this number are not considered as factors (2 by default)
+    :return: True if n can be written as the product of count or less primes in primes excluding prime
+    """
+    for p in reversed(primes):
+        if p < lowest:
+            break
+        if p == prime or p == 1:
+            continue
+        while n % p == 0:
+            n //= p
+            count -= 1
+    return n == 1 and count >= 0
+
+
+def iter_file(filename):
+    """
+    Lazily reads the file given the filename assuming it has the contest structure. Test cases are yielded in the same
+    order they appear in the file, so only one line is kept in memory at a time.
     :param filename: name of the file to be read
-    :return: a list of triplets (ID, TARGET, PRIME)
+    :return: a generator of triplets (ID, TARGET, PRIME)
     """
-    result = []
     with open(filename, 'r') as file:
         for line in file:
-            if "ID" in line:
+            if "ID" in line or not line.strip():
                 continue
-            result.append(tuple(map(int, line.split('|'))))
-            # Lower targets before
-            result.sort(key = lambda itp: itp[1])
+            yield tuple(map(int, line.split('|')))
         file.close()
-    return result
+
+
+def read_file(filename):
+    """
+    Reads the file given the filename assuming it has the contest structure.
+    :param filename: name of the file to be read
+    :return: a list of triplets (ID, TARGET, PRIME) sorted by target
+    """
+    # Lower targets before
+    return sorted(iter_file(filename), key = lambda itp: itp[1])
+
+
+def schedule(entries, workers):
+    """
+    Splits the test cases into chunks to be solved by the worker processes. Every chunk only has test cases with the
+    same prime so they share the subproblems solved by the process, and chunks with the greatest targets go first so
+    the slowest test cases don't end up at the tail of the execution.
+    :param entries: list of triplets (ID, TARGET, PRIME)
+    :param workers: number of worker processes
+    :return: a list of chunks, each one a list of triplets (ID, TARGET, PRIME) in decreasing target order
+    """
+    # Enough chunks to keep every process busy
+    size = max(1, min(CHUNK_SIZE, len(entries) // (workers * 4)))
+    groups = {}
+    for entry in sorted(entries, key = lambda itp: itp[1], reverse = True):
+        groups.setdefault(entry[2], []).append(entry)
+    chunks = [group[i:i + size] for group in groups.values() for i in range(0, len(group), size)]
+    chunks.sort(key = lambda chunk: chunk[0][1], reverse = True)
+    return chunks
+
+
+def imap_window(pool, func, chunks):
+    """
+    Maps func over chunks in the given pool keeping at most BATCH_SIZE chunks in flight, so chunks can be a
+    generator over a file too big to fit in memory. A new chunk is sent every time the oldest one is done, so the
+    workers never wait for the slowest chunk of a batch.
+    :param pool: multiprocessing pool where func is run
+    :param func: function to be applied to every chunk
+    :param chunks: iterable with all chunks
+    :return: a generator with the results in the same order as chunks
+    """
+    chunks = iter(chunks)
+    pending = deque(pool.apply_async(func, (chunk,)) for chunk in islice(chunks, BATCH_SIZE))
+    while pending:
+        result = pending.popleft().get()
+        # Refill the window before handing the result over so the workers don't wait for the caller
+        for chunk in islice(chunks, 1):
+            pending.append(pool.apply_async(func, (chunk,)))
+        yield result
 
 
 def write_result(file, test_id, count, expression, flush = False):
@@ -475,21 +1535,90 @@ def write_timestamp(file, date = None):
     file.write(date)
 
 
-def main():
+def solve_case(entry, deadline = None, stats = None):
+    """
+    Solves a single test case. It must be a module level function so it can be sent to the worker processes.
+    :param entry: a triplet (ID, TARGET, PRIME)
+    :param deadline: time() value at which the whole batch must stop searching (None for no limit)
+    :param stats: SearchStats where the statistics of the search are added (None to not collect them)
+    :return: a triplet (ID, count, expression) where count is the number of primes used in expression
+    """
+    test_id, target, prime = entry
+    result = RESULT_CACHE.get(target, prime)
+    if result is not None:
+        expression, count = result
+        return test_id, count, expression
+    if MAX_CASE_TIME is not None:
+        case_deadline = time() + MAX_CASE_TIME
+        deadline = case_deadline if deadline is None else min(deadline, case_deadline)
+    expression, count = find_expression(target, PRIMES, prime, deadline, stats)
+    # Only complete searches are cached: the result may not be the best one if the deadline was reached
+    if deadline is None or time() < deadline:
+        RESULT_CACHE.put(target, prime, expression, count)
+    return test_id, count, expression
+
+
+def solve_chunk(chunk, deadline = None, collect_stats = False):
     """
-    Function that read the file, launches the algorithm on multiple threads and writes the result.
+    Solves every test case in the given chunk in the same process.
+    :param chunk: list of triplets (ID, TARGET, PRIME)
+    :param deadline: time() value at which the whole batch must stop searching (None for no limit)
+    :param collect_stats: determines whether to collect the statistics of the searches or not (False by default)
+    :return: a pair (results, stats) where results is a list of triplets (ID, count, expression) in the same order as
+    chunk and stats is a SearchStats with the statistics of the whole chunk (None if they're not collected)
+    """
+    stats = SearchStats() if collect_stats else None
+    return [solve_case(entry, deadline, stats) for entry in chunk], stats
+
+
+def main(workers = None, stream = False, stats_filename = None):
+    """
+    Function that read the file, launches the algorithm on multiple processes and writes the result.
+    :param workers: number of worker processes (NUM_WORKERS or the number of cores by default)
+    :param stream: if True test cases are solved while the file is being read, in file order, instead of loading and
+    scheduling them all first (False by default)
+    :param stats_filename: name of the JSON file where the search statistics are written (STATS_FILENAME by default)
     :return: nothing
     """
     start_time = time()
-    entries = read_file(IN_FILENAME)
+    stats_filename = stats_filename or STATS_FILENAME
+    stats = SearchStats()
+    # Stop searching early enough to write every result before MAX_TIME
+    solve = partial(solve_chunk, deadline = start_time + MAX_TIME - SAFETY_TIME, collect_stats = bool(stats_filename))
+    workers = workers or NUM_WORKERS or cpu_count()
+    if stream:
+        entries = iter_file(IN_FILENAME)
+        chunks = iter(lambda: list(islice(entries, CHUNK_SIZE)), [])
+    else:
+        chunks = schedule(read_file(IN_FILENAME), workers)
     with open(OUT_FILENAME, 'w') as out_file:
         write_timestamp(out_file, START_MOMENT)
-        for test_id, target, prime in entries:
-            expression, count = find_expression(target, PRIMES, prime)
-            # Flush only if we are running out of time
-            write_result(out_file, test_id, count, expression, flush = time() - start_time > MAX_TIME - 15)
+        if workers > 1:
+            # Built before forking so every worker shares the same copy
+            for prime in PRIMES:
+                get_meet_layer(prime)
+            pool = Pool(workers)
+            results = imap_window(pool, solve, chunks)
+        else:
+            pool = None
+            results = map(solve, chunks)
+        # imap yields the results in the same order as chunks so the output is deterministic
+        for chunk_results, chunk_stats in results:
+            if chunk_stats is not None:
+                stats.add(chunk_stats)
+            for test_id, count, expression in chunk_results:
+                # Flush only if we are running out of time
+                write_result(out_file, test_id, count, expression,
+                             flush = time() - start_time > MAX_TIME - SAFETY_TIME)
+        if pool:
+            pool.close()
+            pool.join()
         write_timestamp(out_file)
         out_file.close()
+    if stats_filename:
+        with open(stats_filename, 'w') as stats_file:
+            json.dump(stats.to_dict(), stats_file, indent = 4)
+            stats_file.close()
 
 
 if __name__ == '__main__':
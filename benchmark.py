@@ -0,0 +1,145 @@
+"""
+Benchmark for find_expression. It solves a reproducible workload stratified by target magnitude and unused prime and
+reports, for every magnitude, latency percentiles, expanded nodes and average primes used. Run it with -s to save the
+results as the baseline; otherwise they are compared with the saved baseline and the script fails on regressions or if
+there is no baseline. Run it with -w W to use the beam search with width W instead, which also reports the average gap
+between its results and their lower bounds (the baseline is only for the exact search).
+"""
+
+import json
+import random
+import sys
+from math import ceil
+from time import time
+
+import SCRIPT
+
+SEED = 20191015
+MAGNITUDES = range(3, 19, 3)
+CASE_TIME = 2
+BASELINE_FILENAME = "benchmark_baseline.json"
+SAVE_BASELINE = len(sys.argv) > 1 and sys.argv[1] == "-s"
+BEAM_WIDTH = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[1] == "-w" else None
+
+""" Maximum allowed ratios between the new results and the baseline ones """
+LATENCY_TOLERANCE = 1.25
+NODES_TOLERANCE = 1.1
+PRIMES_TOLERANCE = 1.0
+""" Results of searches cut by CASE_TIME depend on the machine load """
+TIMEOUT_PRIMES_TOLERANCE = 1.1
+""" Latency differences (in secs) below this are just noise """
+LATENCY_SLACK = 0.01
+
+
+def generate_workload():
+    rng = random.Random(SEED)
+    workload = {}
+    for magnitude in MAGNITUDES:
+        primes = SCRIPT.PRIMES.copy()
+        rng.shuffle(primes)
+        workload[magnitude] = [(rng.randrange(10 ** magnitude, 10 ** (magnitude + 1)), prime) for prime in primes]
+    return workload
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, ceil(q * len(values)) - 1)]
+
+
+def run(cases):
+    latencies = []
+    nodes = 0
+    primes = 0
+    timeouts = 0
+    gap = 0
+    for target, prime in cases:
+        # Every case is measured on its own
+        SCRIPT.SUBPROBLEMS[prime].clear()
+        stats = SCRIPT.SearchStats()
+        start = time()
+        _, count = SCRIPT.find_expression(target, SCRIPT.PRIMES, prime, start + CASE_TIME, stats)
+        latency = time() - start
+        latencies.append(latency)
+        nodes += stats.popped
+        primes += count
+        timeouts += latency >= CASE_TIME
+        gap += stats.beam_gap
+    return {
+        "cases": len(cases),
+        "latency": sum(latencies) / len(cases),
+        "p50": percentile(latencies, 0.5),
+        "p90": percentile(latencies, 0.9),
+        "p99": percentile(latencies, 0.99),
+        "nodes": nodes / len(cases),
+        "primes": primes / len(cases),
+        "timeouts": timeouts,
+        "gap": gap / len(cases)
+    }
+
+
+def compare(results, baseline):
+    regressions = []
+    for magnitude, result in results.items():
+        if magnitude not in baseline:
+            continue
+        base = baseline[magnitude]
+        timeouts = result["timeouts"] or base["timeouts"]
+        checks = [("p50", LATENCY_TOLERANCE, LATENCY_SLACK), ("p90", LATENCY_TOLERANCE, LATENCY_SLACK),
+                  ("nodes", NODES_TOLERANCE, 0),
+                  ("primes", TIMEOUT_PRIMES_TOLERANCE if timeouts else PRIMES_TOLERANCE, 0)]
+        for key, tolerance, slack in checks:
+            # Searches cut by CASE_TIME expand more nodes the faster they are
+            if key == "nodes" and timeouts:
+                continue
+            if result[key] > base[key] * tolerance + slack:
+                regressions.append(f"10^{magnitude} {key}: {result[key]:.4f} > {base[key]:.4f} (x{tolerance})")
+    return regressions
+
+
+def read_baseline():
+    try:
+        with open(BASELINE_FILENAME, 'r') as file:
+            baseline = json.load(file)
+            file.close()
+    except FileNotFoundError:
+        return None
+    return baseline
+
+
+def main():
+    SCRIPT.BEAM_WIDTH = BEAM_WIDTH
+    # The gate can't pass without something to compare with, so fail before running the workload
+    baseline = None
+    if not SAVE_BASELINE and BEAM_WIDTH is None:
+        baseline = read_baseline()
+        if baseline is None:
+            print("No baseline found: run with -s to save one")
+            sys.exit(1)
+    # Tables built on demand are part of the startup, not of the first case of every prime
+    for prime in SCRIPT.PRIMES:
+        SCRIPT.get_divisor_plan(prime)
+        SCRIPT.get_meet_layer(prime)
+    results = {}
+    for magnitude, cases in generate_workload().items():
+        result = run(cases)
+        results[str(magnitude)] = result
+        print(f"10^{magnitude}: p50 {result['p50']:.4f}s p90 {result['p90']:.4f}s p99 {result['p99']:.4f}s, "
+              f"{result['nodes']:.1f} nodes, {result['primes']:.2f} primes, {result['timeouts']} timeouts" +
+              (f", {result['gap']:.2f} gap" if BEAM_WIDTH is not None else ""))
+    if BEAM_WIDTH is not None:
+        return
+    if SAVE_BASELINE:
+        with open(BASELINE_FILENAME, 'w') as file:
+            json.dump(results, file, indent = 4)
+            file.close()
+        return
+    regressions = compare(results, baseline)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if regressions:
+        sys.exit(1)
+    print("\nNo regressions")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import sys
+from time import time
+
+import SCRIPT
+
+IN_FILENAME = sys.argv[1] if len(sys.argv) > 1 else SCRIPT.IN_FILENAME
+
+
+def max_prime_estimation(n, primes, prime):
+    # Previous lower bound: every division is by the maximum prime and leaves no remainder
+    max_prime = primes[-1] if prime != primes[-1] else primes[-2]
+    min_count = 0
+    while n > max_prime:
+        n //= max_prime
+        min_count += 1
+    return min_count
+
+
+def run(estimation, entries):
+    SCRIPT.estimation = estimation
+    for solved in SCRIPT.SUBPROBLEMS.values():
+        solved.clear()
+    stats = SCRIPT.SearchStats()
+    total = 0
+    start = time()
+    for _, target, prime in entries:
+        _, count = SCRIPT.find_expression(target, SCRIPT.PRIMES, prime, stats = stats)
+        total += count
+    return stats.popped, total, time() - start
+
+
+def main():
+    # The meet layer bounds every quotient with MEET_COST primes, which hides the difference between both estimations
+    SCRIPT.MEET_COST = 0
+    # Tables built on demand are part of the startup, not of the first estimation
+    for prime in SCRIPT.PRIMES:
+        SCRIPT.get_divisor_plan(prime)
+        SCRIPT.get_meet_layer(prime)
+    entries = SCRIPT.read_file(IN_FILENAME)
+    estimations = [("max prime", max_prime_estimation), ("product aware", SCRIPT.estimation)]
+    for name, estimation in estimations:
+        expanded, total, elapsed = run(estimation, entries)
+        print(f"{name}: {expanded} expanded nodes, {total} primes, {elapsed:.2f} secs")
+
+
+if __name__ == '__main__':
+    main()
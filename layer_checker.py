@@ -0,0 +1,44 @@
+"""
+Checker of the meet layers. For every prime it computes the exact costs of the numbers below LIMIT with
+build_cost_table and checks that every number above the table ceiling whose cost is within the cost of the layer is
+in it with that cost, as find_expression takes any number out of the layer as needing more primes. Run it with -n to
+check the layers built without the cost table.
+"""
+
+import sys
+
+import SCRIPT
+
+LIMIT = 2 * 10 ** 5
+NO_TABLE = len(sys.argv) > 1 and sys.argv[1] == "-n"
+
+
+def check(prime):
+    layer = SCRIPT.get_meet_layer(prime)
+    costs = SCRIPT.build_cost_table(prime, LIMIT)
+    ceiling = max(len(SCRIPT.COST_TABLE[prime]), SCRIPT.MIN_NON_DECOMPOSABLE) if SCRIPT.COST_TABLE else \
+        SCRIPT.MIN_NON_DECOMPOSABLE
+    errors = []
+    for n in range(ceiling, LIMIT):
+        count = layer.get(n)
+        if (costs[n] <= layer.cost or count) and count != costs[n]:
+            errors.append((n, costs[n], count))
+    return layer.cost, errors
+
+
+def main():
+    if NO_TABLE:
+        SCRIPT.COST_TABLE = None
+    failed = False
+    for prime in SCRIPT.PRIMES:
+        cost, errors = check(prime)
+        for n, expected, count in errors[:5]:
+            print(f"ERROR: prime {prime}: {n} needs {expected} primes and the layer has {count or 'no'} primes")
+        print(f"prime {prime}: layer cost {cost}, {len(errors)} errors")
+        failed |= bool(errors)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""
+Tuner of the probe policy. It sweeps the ratios and budgets of the probes over the benchmark workload and writes the
+best setting of every magnitude in PROBE_FILENAME, which SCRIPT.py reads at startup. The best setting is the one that
+uses the least primes on average and, among those, the one with the lowest average latency.
+"""
+
+import SCRIPT
+from benchmark import generate_workload, run
+
+""" Ratios r = num/den swept (0/1 probes from every node) """
+RATIOS = [(0, 1), (1, 1), (5, 4), (3, 2), (2, 1), (3, 1)]
+
+""" Budgets of probes swept for every ratio (None for no limit) """
+BUDGETS = [None, 64, 8]
+
+
+def get_settings():
+    # A budget of 0 never probes, whatever the ratio is
+    return [(num, den, budget) for num, den in RATIOS for budget in BUDGETS] + [(SCRIPT.NUM, SCRIPT.DEN, 0)]
+
+
+def main():
+    for prime in SCRIPT.PRIMES:
+        SCRIPT.get_divisor_plan(prime)
+        SCRIPT.get_meet_layer(prime)
+    best = {}
+    for magnitude, cases in generate_workload().items():
+        scores = []
+        for setting in get_settings():
+            SCRIPT.PROBE_POLICY = SCRIPT.ProbePolicy({magnitude: setting})
+            result = run(cases)
+            latency = result["latency"]
+            print(f"10^{magnitude} {setting}: {result['primes']:.2f} primes, {latency:.4f}s, "
+                  f"{result['timeouts']} timeouts")
+            scores.append(((result["primes"], latency), setting))
+        (primes, latency), best[magnitude] = min(scores, key = lambda score: score[0])
+        print(f"10^{magnitude} best: {best[magnitude]} ({primes:.2f} primes, {latency:.4f}s)\n")
+    SCRIPT.write_probe_policy(SCRIPT.PROBE_FILENAME, SCRIPT.ProbePolicy(best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,13 @@
+import sys
+
+from SCRIPT import TABLE_CEILING, TABLE_FILENAME, write_cost_table
+
+CEILING = int(sys.argv[1]) if len(sys.argv) > 1 else TABLE_CEILING
+
+
+def main():
+    write_cost_table(TABLE_FILENAME, CEILING)
+
+
+if __name__ == '__main__':
+    main()